@@ -3,10 +3,25 @@
 Parses a ZMK keymap file and generates a markdown visualization.
 """
 
+import functools
+import os
 import re
 import sys
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+# Compiled once at import so repeated parses skip re's per-call cache lookup
+# Both comment forms in one alternation; the shared '/' prefix lets the
+# engine's literal-prefix optimization find candidates in a single pass.
+# Applied per line (no newlines present), so no DOTALL is needed.
+_COMMENTS_RE = re.compile(r'//[^\n]*|/\*.*?\*/')
+# The negated classes already cross newlines, so no DOTALL is needed. The
+# pre-bindings scan must stay lazy (still linear on a negated class): a
+# greedy scan would latch onto the 'bindings' suffix of 'sensor-bindings'
+# in encoder-equipped layers and capture the wrong list.
+_LAYER_RE = re.compile(r'(Layer_\d+|layer_\d+)\s*\{[^{}]*?bindings\s*=\s*<([^>]*)>')
+
 # Key display mappings for common ZMK keycodes
 KEY_DISPLAY = {
     # Letters
@@ -49,137 +64,150 @@ KEY_DISPLAY = {
     "trans": "▽", "none": "X",
 }
 
+# Normalizes newlines, carriage returns, and tabs to spaces in one C-level pass
+_WS_TABLE = str.maketrans('\n\r\t', '   ')
+
+# Full Corne (3x6+3 split) layer rendered in one %-format expansion: the
+# layer name followed by the 42 keys, pre-centered to the 7-cell width.
+_CORNE_FMT = """\
+### %s
+```
+┌───────┬───────┬───────┬───────┬───────┬───────┐       ┌───────┬───────┬───────┬───────┬───────┬───────┐
+│%s│%s│%s│%s│%s│%s│       │%s│%s│%s│%s│%s│%s│
+├───────┼───────┼───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┼───────┼───────┤
+│%s│%s│%s│%s│%s│%s│       │%s│%s│%s│%s│%s│%s│
+├───────┼───────┼───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┼───────┼───────┤
+│%s│%s│%s│%s│%s│%s│       │%s│%s│%s│%s│%s│%s│
+└───────┴───────┴───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┴───────┴───────┘
+                        │%s│%s│%s│       │%s│%s│%s│
+                        └───────┴───────┴───────┘       └───────┴───────┴───────┘
+```"""
+
 
+@functools.lru_cache(maxsize=512)
 def parse_binding(binding: str) -> str:
     """Convert a ZMK binding to a display string."""
     binding = binding.strip().lstrip("&")
-    
-    # Handle layer toggles
-    if binding.startswith("mo "):
-        layer_num = binding.split()[1]
-        return f"L{layer_num}"
-    if binding.startswith("to "):
-        layer_num = binding.split()[1]
-        return f"TO{layer_num}"
-    if binding.startswith("lt "):
-        parts = binding.split()
-        return f"LT{parts[1]}"
-    
-    # Look up in display mappings
-    if binding in KEY_DISPLAY:
-        return KEY_DISPLAY[binding]
-    
-    # Handle kp with unknown key
-    if binding.startswith("kp "):
-        return binding[3:].capitalize()
-    
-    return binding[:6]  # Truncate unknown bindings
+    head, _, rest = binding.partition(" ")
 
+    # Single structural dispatch on the first token (jump table in 3.11+)
+    # Behaviors missing their argument fall through to the default case
+    match head:
+        # Layer toggles
+        case "mo" if rest:
+            return f"L{rest.split()[0]}"
+        case "to" if rest:
+            return f"TO{rest.split()[0]}"
+        case "lt" if rest:
+            return f"LT{rest.split()[0]}"
+        case "kp" if rest:
+            # Letters and digits cover most keys on a typical layer; derive
+            # their display directly instead of probing the dict
+            if len(rest) == 1 and rest.isupper():
+                return rest
+            if len(rest) == 2 and rest[0] == "N" and rest[1].isdigit():
+                return rest[1]
+            display = KEY_DISPLAY.get(binding)
+            # Handle kp with unknown key
+            return display if display is not None else rest.capitalize()
+        case _:
+            # Look up in display mappings; truncate unknown bindings
+            return KEY_DISPLAY.get(binding, binding[:6])
 
-def parse_keymap(content: str) -> dict:
-    """Parse a ZMK keymap file and extract layers."""
-    layers = {}
-    
-    # Remove C-style comments that might contain braces
-    # Remove // line comments
-    content_no_comments = re.sub(r'//[^\n]*', '', content)
-    # Remove /* */ block comments
-    content_no_comments = re.sub(r'/\*.*?\*/', '', content_no_comments, flags=re.DOTALL)
-    
-    # Find all layer blocks with bindings
+
+def _strip_comments(lines: Iterable[str]) -> Iterable[str]:
+    """Yield lines with // and /* */ comments removed.
+
+    Works one line at a time so memory stays bounded by the longest line;
+    only a flag is carried across lines while inside a /* */ block.
+    """
+    in_block = False
+    for line in lines:
+        line = line.rstrip('\n')
+        if in_block:
+            end = line.find('*/')
+            if end == -1:
+                yield ''
+                continue
+            line = line[end + 2:]
+            in_block = False
+        # Cheap substring check first: generated keymaps usually have no
+        # comments at all, and the common case skips the scan entirely.
+        if '/' in line:
+            # One combined pass removes // comments and /* */ pairs that
+            # close on this line; a leftover /* is an unterminated opener.
+            line = _COMMENTS_RE.sub('', line)
+            start = line.find('/*')
+            if start != -1:
+                line = line[:start]
+                in_block = True
+        yield line
+
+
+def parse_keymap(lines: Iterable[str]) -> dict:
+    """Parse a ZMK keymap, given as an iterable of lines, and extract layers."""
+    layers = []
+
+    # Remove C-style comments (which might contain braces) line by line, so
+    # a large include-expanded keymap never needs three full copies in memory.
+    content_no_comments = '\n'.join(_strip_comments(lines))
+
+    # Find all layer blocks with bindings, iterated lazily so the match
+    # list is never materialized
     # Match pattern: LayerName { ... bindings = <keys>; ... }
-    layer_pattern = r'(Layer_\d+|layer_\d+)\s*\{[^{}]*?bindings\s*=\s*<\s*([^>]+)\s*>'
-    matches = re.findall(layer_pattern, content_no_comments, re.DOTALL)
-    
-    for layer_name, bindings_str in matches:
+    for match in _LAYER_RE.finditer(content_no_comments):
+        layer_name, bindings_str = match.group(1), match.group(2)
         # Parse bindings
-        bindings_str = bindings_str.replace('\n', ' ')
-        # Split by & but keep the &
-        raw_bindings = re.split(r'(?=&)', bindings_str)
-        bindings = [b.strip() for b in raw_bindings if b.strip()]
-        
+        bindings_str = bindings_str.translate(_WS_TABLE)
+        # Every binding starts with &, so a plain split is enough
+        bindings = ['&' + b.strip() for b in bindings_str.split('&') if b.strip()]
+
         # Only include if it looks like a full layer (more than just a few keys)
         if len(bindings) >= 36:  # Corne has at least 36 keys
-            layers[layer_name] = bindings
-    
+            # The layer name always ends in _<number>; extract it once here
+            # so sorting needs no regex in its key function
+            layers.append((int(layer_name.rsplit('_', 1)[1]), layer_name, bindings))
+
     # Sort layers by number
-    sorted_layers = {}
-    for name in sorted(layers.keys(), key=lambda x: int(re.search(r'\d+', x).group())):
-        sorted_layers[name] = layers[name]
-    
-    return sorted_layers
+    return {name: bindings for _, name, bindings in sorted(layers)}
 
 
 def format_corne_layer(bindings: list, layer_name: str) -> str:
     """Format a layer for a Corne (3x6+3 split) keyboard."""
     keys = [parse_binding(b) for b in bindings]
-    
+
     # Corne has 42 keys total (6x3 + 3 thumb per side = 36 + 6)
     if len(keys) < 42:
-        keys.extend([""] * (42 - len(keys)))
-    
-    # Corne layout: 6 keys per row, 3 rows, plus 3 thumb keys per side
-    def fmt(key, width=7):
-        return key.center(width)
-    
-    lines = []
-    lines.append(f"### {layer_name}")
-    lines.append("```")
-    lines.append("┌───────┬───────┬───────┬───────┬───────┬───────┐       ┌───────┬───────┬───────┬───────┬───────┬───────┐")
-    
-    # Row 1
-    row1_left = "│".join([fmt(keys[i]) for i in range(6)])
-    row1_right = "│".join([fmt(keys[i]) for i in range(6, 12)])
-    lines.append(f"│{row1_left}│       │{row1_right}│")
-    
-    lines.append("├───────┼───────┼───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┼───────┼───────┤")
-    
-    # Row 2
-    row2_left = "│".join([fmt(keys[i]) for i in range(12, 18)])
-    row2_right = "│".join([fmt(keys[i]) for i in range(18, 24)])
-    lines.append(f"│{row2_left}│       │{row2_right}│")
-    
-    lines.append("├───────┼───────┼───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┼───────┼───────┤")
-    
-    # Row 3
-    row3_left = "│".join([fmt(keys[i]) for i in range(24, 30)])
-    row3_right = "│".join([fmt(keys[i]) for i in range(30, 36)])
-    lines.append(f"│{row3_left}│       │{row3_right}│")
-    
-    lines.append("└───────┴───────┴───────┼───────┼───────┼───────┤       ├───────┼───────┼───────┼───────┴───────┴───────┘")
-    
-    # Thumb row
-    thumb_left = "│".join([fmt(keys[i]) for i in range(36, 39)])
-    thumb_right = "│".join([fmt(keys[i]) for i in range(39, 42)])
-    lines.append(f"                        │{thumb_left}│       │{thumb_right}│")
-    
-    lines.append("                        └───────┴───────┴───────┘       └───────┴───────┴───────┘")
-    lines.append("```")
-    
-    return "\n".join(lines)
+        keys += [""] * (42 - len(keys))
+
+    centered = tuple(k.center(7) for k in keys)
+    return _CORNE_FMT % ((layer_name,) + centered)
 
 
 def generate_markdown(keymap_path: str) -> str:
     """Generate markdown documentation for a keymap."""
-    content = Path(keymap_path).read_text()
-    layers = parse_keymap(content)
-    
-    output = []
-    output.append("## Keymap")
-    output.append("")
-    output.append(f"*Auto-generated from [`{Path(keymap_path).name}`](config/{Path(keymap_path).name})*")
-    output.append("")
-    output.append("**Legend:**")
-    output.append("- `▽` = Transparent (uses key from lower layer)")
-    output.append("- `X` = None (no action)")
-    output.append("- `L#` = Momentary layer switch")
-    output.append("")
-    
-    for layer_name, bindings in layers.items():
-        output.append(format_corne_layer(bindings, layer_name))
-        output.append("")
-    
-    return "\n".join(output)
+    path = Path(keymap_path)
+    with path.open() as keymap_file:
+        layers = parse_keymap(keymap_file)
+
+    name = path.name
+    header = (
+        f"## Keymap\n"
+        f"\n"
+        f"*Auto-generated from [`{name}`](config/{name})*\n"
+        f"\n"
+        f"**Legend:**\n"
+        f"- `▽` = Transparent (uses key from lower layer)\n"
+        f"- `X` = None (no action)\n"
+        f"- `L#` = Momentary layer switch\n"
+        f"\n"
+    )
+
+    layer_blocks = "\n\n".join(
+        format_corne_layer(bindings, layer_name)
+        for layer_name, bindings in layers.items()
+    )
+    return f"{header}{layer_blocks}\n"
 
 
 def update_readme(readme_path: str, keymap_content: str) -> None:
@@ -190,26 +218,46 @@ def update_readme(readme_path: str, keymap_content: str) -> None:
     readme = Path(readme_path)
     if readme.exists():
         content = readme.read_text()
-        if start_marker in content and end_marker in content:
-            before = content.split(start_marker)[0]
-            after = content.split(end_marker)[1]
-            new_content = f"{before}{start_marker}\n{keymap_content}\n{end_marker}{after}"
-            readme.write_text(new_content)
+        try:
+            start = content.index(start_marker) + len(start_marker)
+            end = content.index(end_marker, start)
+        except ValueError:
+            pass
+        else:
+            new_content = f"{content[:start]}\n{keymap_content}\n{content[end:]}"
+            # Write to a sibling temp file and rename so a crash mid-write
+            # can never leave a truncated README behind
+            tmp = readme.with_suffix(readme.suffix + ".tmp")
+            tmp.write_text(new_content)
+            os.replace(tmp, readme)
             return
-    
+
     print(f"Warning: Could not find markers in {readme_path}")
 
 
+def main_batch(files: list[str]) -> dict[str, str]:
+    """Generate markdown for several keymaps in parallel, one worker each."""
+    with ProcessPoolExecutor() as executor:
+        return dict(zip(files, executor.map(generate_markdown, files)))
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: generate_keymap.py <keymap_file> [readme_file]")
+        print("       generate_keymap.py <keymap_file> <keymap_file> ...")
         sys.exit(1)
-    
-    keymap_file = sys.argv[1]
-    markdown = generate_markdown(keymap_file)
-    
-    if len(sys.argv) >= 3:
-        update_readme(sys.argv[2], markdown)
-        print(f"Updated {sys.argv[2]}")
+
+    args = sys.argv[1:]
+    if len(args) > 1 and all(a.endswith(".keymap") for a in args):
+        # Batch mode: parsing is CPU-bound, so fan out across cores
+        for markdown in main_batch(args).values():
+            print(markdown)
     else:
-        print(markdown)
+        keymap_file = args[0]
+        markdown = generate_markdown(keymap_file)
+
+        if len(args) >= 2:
+            update_readme(args[1], markdown)
+            print(f"Updated {args[1]}")
+        else:
+            print(markdown)